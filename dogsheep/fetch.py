@@ -1,8 +1,8 @@
-from collections import namedtuple
 import ast
 import json
 import os
 import sqlite3
+import sys
 
 # This script queries the Apple Photos database and returns a GeoJSON blob
 # which can be uploaded to Felt (or appropriate source)
@@ -16,125 +16,93 @@ import sqlite3
 # fetched from the environment
 album_name = os.environ.get("ALBUM")
 
-RowData = namedtuple('RowData', [
-    'sha256',
-    'uuid',
-    'burst_uuid',
-    'filename',
-    'original_filename',
-    'description',
-    'date',
-    'date_modified',
-    'title',
-    'keywords',
-    'albums',
-    'persons',
-    'path',
-    'ismissing',
-    'hasadjustments',
-    'external_edit',
-    'favorite',
-    'hidden',
-    'latitude',
-    'longitude',
-    'path_edited',
-    'shared',
-    'isphoto',
-    'ismovie',
-    'uti',
-    'burst',
-    'live_photo',
-    'path_live_photo',
-    'iscloudasset',
-    'incloud',
-    'portrait',
-    'screenshot',
-    'slow_mo',
-    'time_lapse',
-    'hdr',
-    'selfie',
-    'panorama',
-    'has_raw',
-    'uti_raw',
-    'path_raw',
-    'place_street',
-    'place_sub_locality',
-    'place_city',
-    'place_sub_administrative_area',
-    'place_state_province',
-    'place_postal_code',
-    'place_country',
-    'place_iso_country_code',
-])
 def query_database(db_file):
     try:
         # Connect to the database
         conn = sqlite3.connect(db_file)
         cursor = conn.cursor()
 
-        # Perform the query
-        query = """SELECT * FROM apple_photos WHERE albums = '["{}"]'""".format(album_name)
-        cursor.execute(query)
-
-        features = []
-
-        rows = cursor.fetchall()
-        for row in rows:
-            f = create_feature(RowData(*row))
-            if f is not None:
-                features.append(f)
-
-        feature_collection = {
-            "type": "FeatureCollection",
-            "features": features
-        }
-
-        geojson_blob = json.dumps(feature_collection, indent=2)
-        print(geojson_blob)
-
+        # Perform the query. Rows without a type: keyword are skipped by
+        # SQLite; create_feature still does the exact prefix check.
+        query = """SELECT original_filename, description, keywords, latitude, longitude
+            FROM apple_photos WHERE albums = ?
+            AND keywords LIKE '%type:%'"""
+        # albums is stored as a JSON encoded list by dogsheep-photos (via
+        # sqlite-utils, with ensure_ascii=False), so encode the parameter the
+        # same way or non-ASCII album names will never match.
+        cursor.execute(query, (json.dumps([album_name], ensure_ascii=False),))
+
+        # Write each feature as it is produced rather than holding the whole
+        # collection (and its encoded form) in memory.
+        out = sys.stdout
+        out.write('{"type": "FeatureCollection", "features": [\n')
+
+        # Fetch in batches rather than materializing every row up front
+        cursor.arraysize = 256
+        first = True
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            for row in rows:
+                f = create_feature(row)
+                if f is None:
+                    continue
+                if not first:
+                    out.write(",\n")
+                out.write(json.dumps(f))
+                first = False
+
+        out.write("\n]}\n")
 
     except sqlite3.Error as e:
-        print("Error while querying the database:", e)
+        # Output may already be partially written, so fail loudly rather than
+        # leave truncated GeoJSON looking like a successful run.
+        print("Error while querying the database:", e, file=sys.stderr)
+        sys.exit(1)
     finally:
         # Close the connection
         if conn:
             conn.close()
 
-def create_feature(row: RowData): 
-    keywords = ast.literal_eval(row.keywords)
+def create_feature(row: tuple): 
+    original_filename, description, raw_keywords, latitude, longitude = row
 
-    # Only concerned with photos which are tagged for bike parking. These are
-    # any with a type: prefix on a keyword
-    x = True
+    # dogsheep-photos stores keywords as a JSON encoded list. Fall back to
+    # literal_eval for databases with Python repr formatted lists.
+    try:
+        keywords = json.loads(raw_keywords)
+    except json.JSONDecodeError:
+        keywords = ast.literal_eval(raw_keywords)
+
+    # Map the various keywords to the appropriate properties in a single pass
+    tags = {}
     for kw in keywords:
         if kw.startswith("type:"):
-            x = False
-    if x:
+            tags["Type"] = kw[5:].partition(":")[0].title()
+        elif kw.startswith("size:"):
+            tags["Size"] = kw[5:].partition(":")[0]
+
+    # Only concerned with photos which are tagged for bike parking. These are
+    # any with a type: prefix on a keyword
+    if "Type" not in tags:
         return None
 
     # Files are assumed to be exported to jpeg for the purposes of delivery and
     # otherwise the original name is retained.
-    filename = row.original_filename.split(".")[0] + ".jpeg"
+    filename = original_filename.split(".")[0] + ".jpeg"
 
     properties = { 
-        "description": row.description if not None else "",
+        "description": description if not None else "",
         "filename": filename,
+        **tags,
     }
 
-    for kw in keywords:
-        if kw.startswith("size"):
-            properties["Size"] = kw.split(":")[1]
-        if kw.startswith("type"):
-            p = kw.split(":")[1]
-            properties["Type"] = p.title()
-
-
-    # Map the various keywords to the appropriate properties.
     return {
         "type": "Feature",
         "geometry": {
             "type": "Point",
-            "coordinates": [row.longitude, row.latitude]
+            "coordinates": [longitude, latitude]
         },
         "properties": properties,
     }